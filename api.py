@@ -1,8 +1,14 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import uuid
+import httpx
+import orjson
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List
-from models import Library, Book
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field, field_validator
+from typing import Any, List, Optional, Tuple
+from models import Library, Book, normalize_isbn
 
 
 # Pydantic models for API
@@ -14,6 +20,22 @@ class BookResponse(BaseModel):
 
 class ISBNRequest(BaseModel):
     isbn: str
+    
+    @field_validator('isbn')
+    @classmethod
+    def validate_isbn(cls, value: str) -> str:
+        return normalize_isbn(value)
+
+
+class ISBNBatchRequest(BaseModel):
+    isbns: List[str] = Field(min_length=1, max_length=100)
+
+
+class BatchItemResponse(BaseModel):
+    isbn: str
+    status_code: int
+    book: Optional[BookResponse] = None
+    detail: Optional[str] = None
 
 
 class ErrorResponse(BaseModel):
@@ -21,11 +43,33 @@ class ErrorResponse(BaseModel):
     message: str
 
 
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson, for trusted data that needs no validation"""
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled client for all Open Library lookups, so connections and TLS sessions are reused
+    app.state.http_client = httpx.AsyncClient(
+        http2=True,
+        timeout=10.0,
+        limits=httpx.Limits(max_keepalive_connections=20)
+    )
+    yield
+    await app.state.http_client.aclose()
+    # Stop the batch writer and fold the mutation log into the snapshot on shutdown
+    await library.close()
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Library Management System",
     description="A modern library management system with book search and management features",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -40,87 +84,119 @@ app.add_middleware(
 # Initialize Library
 library = Library()
 
+# Distinguishes ETags issued by this process from ones issued before a restart
+BOOT_ID = uuid.uuid4().hex[:8]
+
+
+def current_etag() -> str:
+    """Weak ETag for the current state of the library"""
+    return f'W/"{BOOT_ID}-{library.version}"'
 
-@app.get("/books", response_model=List[BookResponse])
-async def get_all_books():
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """Check whether the client's If-None-Match header already matches the ETag"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+
+def error_status(exc: Exception) -> Tuple[int, str]:
+    """Map an error raised by the library to the API's status code and detail message"""
+    if isinstance(exc, ValueError):
+        return 400, str(exc)
+    if isinstance(exc, ConnectionError):
+        return 503, f"Service unavailable: {str(exc)}"
+    return 500, f"Internal server error: {str(exc)}"
+
+
+@app.get("/books", responses={200: {"model": List[BookResponse]}})
+async def get_all_books(request: Request):
     """Get all books in the library"""
-    try:
-        books = library.list_books()
-        return [BookResponse(title=book.title, author=book.author, isbn=book.isbn) 
-                for book in books]
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    async with library.lock.reader:
+        etag = current_etag()
+        if is_not_modified(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        body = library.books_json()
+    
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
 
-@app.post("/books", response_model=BookResponse)
-async def add_book_by_isbn(isbn_request: ISBNRequest):
+@app.post("/books", responses={200: {"model": BookResponse}})
+async def add_book_by_isbn(isbn_request: ISBNRequest, request: Request):
     """Add a book by ISBN using Open Library API"""
-    try:
-        book = library.add_book_by_isbn(isbn_request.isbn)
-        return BookResponse(title=book.title, author=book.author, isbn=book.isbn)
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except ConnectionError as e:
-        raise HTTPException(status_code=503, detail=f"Service unavailable: {str(e)}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-
-
-@app.get("/books/{isbn}", response_model=BookResponse)
-async def get_book_by_isbn(isbn: str):
+    book = await library.add_book_by_isbn(isbn_request.isbn, client=request.app.state.http_client)
+    return ORJSONResponse(book.to_dict())
+
+
+@app.post("/books/batch", responses={200: {"model": List[BatchItemResponse]}})
+async def add_books_by_isbn(batch_request: ISBNBatchRequest, request: Request):
+    """Add several books by ISBN, looking them up concurrently.
+    
+    Each ISBN gets its own status code, using the same codes as POST /books.
+    """
+    client = request.app.state.http_client
+    results = await asyncio.gather(
+        *(library.add_book_by_isbn(isbn, client=client) for isbn in batch_request.isbns),
+        return_exceptions=True
+    )
+    
+    items = []
+    for isbn, result in zip(batch_request.isbns, results):
+        if isinstance(result, Book):
+            items.append({"isbn": isbn, "status_code": 200, "book": result.to_dict()})
+        else:
+            status_code, detail = error_status(result)
+            items.append({"isbn": isbn, "status_code": status_code, "detail": detail})
+    return ORJSONResponse(items)
+
+
+@app.get("/books/{isbn}", responses={200: {"model": BookResponse}})
+async def get_book_by_isbn(isbn: str, request: Request):
     """Get a specific book by ISBN"""
-    try:
-        book = library.find_book(isbn)
-        if book is None:
-            raise HTTPException(status_code=404, detail=f"Book with ISBN {isbn} not found")
-        
-        return BookResponse(title=book.title, author=book.author, isbn=book.isbn)
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    async with library.lock.reader:
+        book = library.find_book(library.resolve_isbn(isbn))
+        etag = current_etag()
+    if book is None:
+        raise HTTPException(status_code=404, detail=f"Book with ISBN {isbn} not found")
+    
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    return ORJSONResponse(book.to_dict(), headers={"ETag": etag})
 
 
 @app.delete("/books/{isbn}")
 async def delete_book(isbn: str):
     """Delete a book by ISBN"""
-    try:
-        success = library.remove_book(isbn)
-        if not success:
-            raise HTTPException(status_code=404, detail=f"Book with ISBN {isbn} not found")
-        
-        return {"message": f"Book with ISBN {isbn} deleted successfully"}
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    success = await library.apply(('del', library.resolve_isbn(isbn)))
+    if not success:
+        raise HTTPException(status_code=404, detail=f"Book with ISBN {isbn} not found")
+    
+    return {"message": f"Book with ISBN {isbn} deleted successfully"}
 
 
 # Exception handlers
 @app.exception_handler(ValueError)
-async def value_error_handler(request, exc):
-    return HTTPException(status_code=400, detail=str(exc))
-
-
 @app.exception_handler(ConnectionError)
-async def connection_error_handler(request, exc):
-    return HTTPException(status_code=503, detail=f"Service unavailable: {str(exc)}")
+@app.exception_handler(Exception)
+async def library_error_handler(request: Request, exc: Exception):
+    status_code, detail = error_status(exc)
+    return JSONResponse(status_code=status_code, content={"detail": detail})
 
 
 # Health check endpoint
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    try:
-        # Check if library can be accessed
-        book_count = len(library.list_books())
-        return {
-            "status": "healthy",
-            "message": "Library Management System is running",
-            "book_count": book_count
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Health check failed: {str(e)}")
+    # Check if library can be accessed
+    async with library.lock.reader:
+        book_count = len(library)
+    return {
+        "status": "healthy",
+        "message": "Library Management System is running",
+        "book_count": book_count
+    }
 
 
 # Root endpoint
@@ -132,4 +208,13 @@ async def root():
         "version": "1.0.0",
         "docs": "/docs",
         "redoc": "/redoc"
-    }
\ No newline at end of file
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+    
+    # uvloop and httptools are the C-accelerated event loop and HTTP parser from uvicorn[standard].
+    # Keep a single worker: each worker process would own a separate Library writing the same files.
+    # The app object is passed directly so uvicorn doesn't import this module a second time.
+    uvicorn.run(app, host="127.0.0.1", port=8000, loop="uvloop", http="httptools")
\ No newline at end of file
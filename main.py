@@ -1,3 +1,9 @@
+import argparse
+import asyncio
+import httpx
+from typing import Set
+from prompt_toolkit import PromptSession
+from prompt_toolkit.patch_stdout import patch_stdout
 from models import Book, Library
 
 
@@ -13,72 +19,88 @@ def display_menu():
     print("="*50)
 
 
-def add_book(library: Library):
+async def lookup_book(library: Library, isbn: str, client: httpx.AsyncClient):
+    """Add a book by ISBN in the background and report the outcome when it finishes"""
+    try:
+        book = await library.add_book_by_isbn(isbn, client=client)
+        print(f"Success: Book '{book.title}' by {book.author} added successfully!")
+    except ValueError as e:
+        print(f"Error: {e}")
+    except ConnectionError as e:
+        print(f"Network Error ({isbn}): {e}")
+        print("Please check your internet connection or try again later.")
+    except Exception as e:
+        print(f"Error: An unexpected error occurred: {e}")
+
+
+async def add_book(library: Library, session: PromptSession, client: httpx.AsyncClient, pending: Set[asyncio.Task]):
     print("\n--- Add New Book ---")
     print("Choose an option:")
     print("1. Manual entry")
     print("2. ISBN lookup (automatic)")
     
     try:
-        choice = input("Enter your choice (1-2): ").strip()
+        choice = (await session.prompt_async("Enter your choice (1-2): ")).strip()
         
         if choice == '1':
             # Manual entry
-            title = input("Enter book title: ").strip()
+            title = (await session.prompt_async("Enter book title: ")).strip()
             if not title:
                 print("Error: Title cannot be empty")
                 return
             
-            author = input("Enter book author: ").strip()
+            author = (await session.prompt_async("Enter book author: ")).strip()
             if not author:
                 print("Error: Author cannot be empty")
                 return
             
-            isbn = input("Enter book ISBN: ").strip()
+            isbn = (await session.prompt_async("Enter book ISBN: ")).strip()
             if not isbn:
                 print("Error: ISBN cannot be empty")
                 return
             
             book = Book(title, author, isbn)
-            library.add_book(book)
+            await library.apply(('add', book))
             print(f"Success: Book '{title}' added successfully!")
         
         elif choice == '2':
-            # ISBN lookup
-            isbn = input("Enter book ISBN: ").strip()
+            # ISBN lookup runs in the background so more books can be queued meanwhile
+            isbn = (await session.prompt_async("Enter book ISBN: ")).strip()
             if not isbn:
                 print("Error: ISBN cannot be empty")
                 return
             
-            print("Looking up book information...")
-            book = library.add_book_by_isbn(isbn)
-            print(f"Success: Book '{book.title}' by {book.author} added successfully!")
+            task = asyncio.create_task(lookup_book(library, isbn, client))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            print(f"Looking up book information for ISBN {isbn} in the background...")
         
         else:
             print("Invalid choice! Please enter 1 or 2.")
     
     except ValueError as e:
         print(f"Error: {e}")
-    except ConnectionError as e:
-        print(f"Network Error: {e}")
-        print("Please check your internet connection or try again later.")
+    except (KeyboardInterrupt, EOFError):
+        raise
     except Exception as e:
         print(f"Error: An unexpected error occurred: {e}")
 
 
-def remove_book(library: Library):
+async def remove_book(library: Library, session: PromptSession):
     print("\n--- Remove Book ---")
     try:
-        isbn = input("Enter ISBN of book to remove: ").strip()
+        isbn = (await session.prompt_async("Enter ISBN of book to remove: ")).strip()
         if not isbn:
             print("Error: ISBN cannot be empty")
             return
         
-        if library.remove_book(isbn):
+        if await library.apply(('del', library.resolve_isbn(isbn))):
             print(f"Success: Book with ISBN {isbn} removed successfully!")
         else:
             print(f"Error: No book found with ISBN {isbn}")
     
+    except (KeyboardInterrupt, EOFError):
+        raise
     except Exception as e:
         print(f"Error: An unexpected error occurred: {e}")
 
@@ -100,61 +122,90 @@ def list_books(library: Library):
         print(f"Error: An unexpected error occurred: {e}")
 
 
-def search_book(library: Library):
+async def search_book(library: Library, session: PromptSession):
     print("\n--- Search Book ---")
     try:
-        isbn = input("Enter ISBN to search: ").strip()
+        isbn = (await session.prompt_async("Enter ISBN to search: ")).strip()
         if not isbn:
             print("Error: ISBN cannot be empty")
             return
         
-        book = library.find_book(isbn)
+        book = library.find_book(library.resolve_isbn(isbn))
         if book:
             print(f"Found: {book}")
         else:
             print(f"No book found with ISBN {isbn}")
     
+    except (KeyboardInterrupt, EOFError):
+        raise
     except Exception as e:
         print(f"Error: An unexpected error occurred: {e}")
 
 
-def main():
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Library Management System")
+    parser.add_argument('--file', default='library.json',
+                        help="library data file; a .gz suffix stores it gzip-compressed")
+    parser.add_argument('--pretty', action='store_true',
+                        help="write the data file indented, for manual inspection")
+    return parser.parse_args(argv)
+
+
+async def main():
+    args = parse_args()
     print("Initializing Library Management System...")
     try:
-        library = Library()
+        library = Library(args.file, pretty=args.pretty)
         print("Library loaded successfully!")
     except Exception as e:
         print(f"Error initializing library: {e}")
         return
     
-    while True:
-        try:
-            display_menu()
-            choice = input("Enter your choice (1-5): ").strip()
+    session = PromptSession()
+    # Background ISBN lookups that have not finished yet
+    pending: Set[asyncio.Task] = set()
+    
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        # Keep the prompt intact while background lookups print their results
+        with patch_stdout():
+            while True:
+                try:
+                    display_menu()
+                    choice = (await session.prompt_async("Enter your choice (1-5): ")).strip()
+                    
+                    if choice == '1':
+                        await add_book(library, session, client, pending)
+                    elif choice == '2':
+                        await remove_book(library, session)
+                    elif choice == '3':
+                        list_books(library)
+                    elif choice == '4':
+                        await search_book(library, session)
+                    elif choice == '5':
+                        print("Thank you for using Library Management System!")
+                        break
+                    else:
+                        print("Invalid choice! Please enter a number between 1-5.")
+                
+                except KeyboardInterrupt:
+                    print("\n\nExiting Library Management System...")
+                    break
+                except EOFError:
+                    print("\n\nExiting Library Management System...")
+                    break
+                except Exception as e:
+                    print(f"Error: An unexpected error occurred: {e}")
             
-            if choice == '1':
-                add_book(library)
-            elif choice == '2':
-                remove_book(library)
-            elif choice == '3':
-                list_books(library)
-            elif choice == '4':
-                search_book(library)
-            elif choice == '5':
-                print("Thank you for using Library Management System!")
-                break
-            else:
-                print("Invalid choice! Please enter a number between 1-5.")
-        
-        except KeyboardInterrupt:
-            print("\n\nExiting Library Management System...")
-            break
-        except EOFError:
-            print("\n\nExiting Library Management System...")
-            break
-        except Exception as e:
-            print(f"Error: An unexpected error occurred: {e}")
+            if pending:
+                print(f"Waiting for {len(pending)} book lookup(s) to finish...")
+                for lookup in asyncio.as_completed(pending):
+                    await lookup
+    
+    try:
+        await library.close()
+    except IOError as e:
+        print(f"Error: {e}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
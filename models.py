@@ -1,119 +1,437 @@
+import aiorwlock
+import asyncio
+import gzip
 import json
 import os
+import re
+import threading
+import zlib
 import httpx
-from typing import List, Optional, Dict
+import ijson
+import orjson
+from collections import OrderedDict
+from typing import Any, List, Optional, Dict, Tuple
+
+
+# ASCII only: str.isdigit() and \d would otherwise accept digits from other scripts
+ISBN_PATTERN = re.compile(r'\d{9}[\dX]|\d{13}', re.ASCII)
+
+
+def normalize_isbn(isbn: str) -> str:
+    """Strip spaces and hyphens from an ISBN-10 or ISBN-13 and verify its check digit.
+    
+    Raises ValueError if the result is not a well-formed ISBN.
+    """
+    normalized = isbn.replace('-', '').replace(' ', '').upper()
+    
+    if not ISBN_PATTERN.fullmatch(normalized):
+        raise ValueError(f"Invalid ISBN: {isbn}")
+    
+    if len(normalized) == 10:
+        digits = [int(char) for char in normalized[:9]] + [10 if normalized[9] == 'X' else int(normalized[9])]
+        if sum(weight * digit for weight, digit in zip(range(10, 0, -1), digits)) % 11 == 0:
+            return normalized
+    elif sum(int(char) * (3 if i % 2 else 1) for i, char in enumerate(normalized)) % 10 == 0:
+        return normalized
+    
+    raise ValueError(f"Invalid ISBN: {isbn}")
 
 
 class Book:
+    __slots__ = ('title', 'author', 'isbn', '_dict')
+    
     def __init__(self, title: str, author: str, isbn: str):
         self.title = title
         self.author = author
         self.isbn = isbn
+        # Books are not modified after creation, so the serialized form is built once
+        self._dict = {
+            'title': title,
+            'author': author,
+            'isbn': isbn
+        }
     
     def __str__(self) -> str:
         return f"{self.title} by {self.author} (ISBN: {self.isbn})"
     
     def to_dict(self) -> Dict[str, str]:
-        return {
-            'title': self.title,
-            'author': self.author,
-            'isbn': self.isbn
-        }
+        """Return the shared serialized form; callers must not modify it"""
+        return self._dict
+
+
+class LRUCache:
+    """Bounded in-memory cache that evicts the least recently used entry"""
+    
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+    
+    def get(self, key: str) -> Optional[Any]:
+        if key not in self._data:
+            return None
+        self._data.move_to_end(key)
+        return self._data[key]
+    
+    def set(self, key: str, value: Any) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def __len__(self) -> int:
+        return len(self._data)
 
 
 class Library:
-    def __init__(self, filename: str = 'library.json'):
+    def __init__(self, filename: str = 'library.json', compact_every: int = 100, pretty: bool = False):
         self.filename = filename
-        self.books: List[Book] = []
+        # Snapshots are compact unless asked for indented output; a .gz filename stores them gzip-compressed
+        self.pretty = pretty
+        self.compressed = filename.endswith('.gz')
+        # Mutations are appended to a log next to the snapshot and folded back into it by compact()
+        self.log_filename = filename + '.log'
+        self.compact_every = compact_every
+        self._log_entries = 0
+        self._compact_lock = threading.Lock()
+        # Books are indexed by ISBN; dicts keep insertion order, so this is also the listing order
+        self._by_isbn: Dict[str, Book] = {}
+        # Bumped on every change so readers can cache anything derived from the book list
+        self.version = 0
+        self._books_json: Optional[Tuple[int, bytes]] = None
+        # Open Library metadata is effectively immutable, so lookups are cached by ISBN and author key
+        self.lookup_cache = LRUCache()
+        # Writes from async callers are queued and flushed in batches by a single writer task
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._lock: Optional[aiorwlock.RWLock] = None
+        self._lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        # ISBN lookups currently in progress, so concurrent requests for one ISBN share a single fetch
+        self._inflight: Dict[str, asyncio.Task] = {}
         self.load_books()
     
+    @property
+    def books(self) -> List[Book]:
+        return list(self._by_isbn.values())
+    
+    def __len__(self) -> int:
+        return len(self._by_isbn)
+    
+    def __contains__(self, isbn: object) -> bool:
+        return isbn in self._by_isbn
+    
     def add_book(self, book: Book) -> None:
-        if self.find_book(book.isbn) is not None:
-            raise ValueError(f"Book with ISBN {book.isbn} already exists")
-        self.books.append(book)
-        self.save_books()
+        pending: Dict[str, Optional[Book]] = {}
+        entry = self._insert(book, pending)
+        self._append_log([entry])
+        self._commit(pending)
+        self._compact_if_due()
     
     def remove_book(self, isbn: str) -> bool:
-        for i, book in enumerate(self.books):
-            if book.isbn == isbn:
-                self.books.pop(i)
-                self.save_books()
-                return True
-        return False
+        pending: Dict[str, Optional[Book]] = {}
+        entry = self._delete(isbn, pending)
+        if entry is None:
+            return False
+        self._append_log([entry])
+        self._commit(pending)
+        self._compact_if_due()
+        return True
+    
+    def books_json(self) -> bytes:
+        """Return the book list serialized as JSON, re-encoding only after a change"""
+        if self._books_json is None or self._books_json[0] != self.version:
+            self._books_json = (self.version, orjson.dumps([book.to_dict() for book in self._by_isbn.values()]))
+        return self._books_json[1]
+    
+    @property
+    def lock(self) -> aiorwlock.RWLock:
+        """Reader/writer lock for async callers.
+        
+        The batch writer holds the writer side while it applies and persists a
+        batch, so readers only ever see changes that are on disk, while any
+        number of readers can proceed together. The lock is bound to the
+        running event loop and recreated if the library is used from a new one.
+        """
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = aiorwlock.RWLock()
+            self._lock_loop = loop
+        return self._lock
+    
+    async def apply(self, op: Tuple[str, Any]) -> Any:
+        """Queue a mutation and wait until it has been persisted.
+        
+        ``op`` is ``('add', book)`` or ``('del', isbn)``. Concurrent calls are
+        applied together and share a single log write and fsync. Returns the
+        added book, or whether a book was removed.
+        """
+        loop = asyncio.get_running_loop()
+        if self._writer is None or self._writer.done() or self._writer.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._writer = loop.create_task(self._run_batches())
+        
+        future = loop.create_future()
+        self._queue.put_nowait((op, future))
+        return await future
+    
+    async def close(self) -> None:
+        """Stop the batch writer once queued writes are flushed and compact the log"""
+        if self._writer is not None and not self._writer.done():
+            # The writer stops at this marker, after resolving every write and compaction before it
+            self._queue.put_nowait(None)
+            await self._writer
+        self._writer = None
+        await asyncio.to_thread(self.compact)
     
     def list_books(self) -> List[Book]:
-        return self.books.copy()
+        return list(self._by_isbn.values())
+    
+    def resolve_isbn(self, isbn: str) -> str:
+        """Map an ISBN as a user typed it to the key its book is stored under.
+        
+        Hyphenated or spaced ISBNs find the book added under their normalized form;
+        ISBNs that are stored verbatim or don't validate are used as given.
+        """
+        if isbn in self:
+            return isbn
+        try:
+            return normalize_isbn(isbn)
+        except ValueError:
+            return isbn
     
     def find_book(self, isbn: str) -> Optional[Book]:
-        for book in self.books:
-            if book.isbn == isbn:
-                return book
-        return None
+        return self._by_isbn.get(isbn)
     
     def load_books(self) -> None:
-        if not os.path.exists(self.filename):
-            self.books = []
-            return
+        self._by_isbn = {}
+        self._log_entries = 0
+        self.version += 1
         
+        if os.path.exists(self.filename):
+            # Stream the snapshot so only one book's raw data is held in memory at a time
+            books: Dict[str, Book] = {}
+            try:
+                with (gzip.open if self.compressed else open)(self.filename, 'rb') as file:
+                    for book_data in ijson.items(file, 'item'):
+                        books[book_data['isbn']] = Book(book_data['title'], book_data['author'], book_data['isbn'])
+                self._by_isbn = books
+            except (ijson.JSONError, KeyError, FileNotFoundError, gzip.BadGzipFile, EOFError, zlib.error):
+                self._by_isbn = {}
+        
+        if os.path.exists(self.log_filename):
+            self._replay_log()
+    
+    def save_books(self, books: Optional[List[Book]] = None) -> None:
+        """Write the snapshot file, from ``books`` if given or else the current books"""
+        if books is None:
+            # Copy the values first so a concurrent mutation can't change the dict mid-iteration
+            books = list(self._by_isbn.values())
+        # Write to a temporary file and swap it in, so a crash never leaves a truncated snapshot
+        temp_filename = self.filename + '.tmp'
         try:
-            with open(self.filename, 'r', encoding='utf-8') as file:
-                data = json.load(file)
-                self.books = [
-                    Book(book_data['title'], book_data['author'], book_data['isbn'])
-                    for book_data in data
-                ]
-        except (json.JSONDecodeError, KeyError, FileNotFoundError):
-            self.books = []
-    
-    def save_books(self) -> None:
-        try:
-            with open(self.filename, 'w', encoding='utf-8') as file:
-                json.dump([book.to_dict() for book in self.books], file, indent=2, ensure_ascii=False)
+            data = orjson.dumps([book.to_dict() for book in books], option=orjson.OPT_INDENT_2 if self.pretty else 0)
+            if self.compressed:
+                data = gzip.compress(data, compresslevel=1)
+            with open(temp_filename, 'wb') as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_filename, self.filename)
         except IOError as e:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
             raise IOError(f"Failed to save books to {self.filename}: {e}")
     
-    def add_book_by_isbn(self, isbn: str) -> Book:
-        # Check if book already exists
-        existing_book = self.find_book(isbn)
-        if existing_book is not None:
-            raise ValueError(f"Book with ISBN {isbn} already exists")
+    def compact(self, books: Optional[List[Book]] = None) -> None:
+        """Fold the mutation log into the snapshot file and truncate the log.
         
+        ``books`` is the current book list when the caller copied it earlier,
+        so the slow write can run without holding the writer lock.
+        """
+        # Compactions run in worker threads, and two at once would share one temporary file
+        with self._compact_lock:
+            self.save_books(books)
+            try:
+                os.remove(self.log_filename)
+            except FileNotFoundError:
+                pass
+            self._log_entries = 0
+    
+    # Changes are staged in a pending dict of ISBN -> book (None once deleted) and only reach
+    # the books once they are in the log, so a failed write leaves nothing to undo
+    def _has(self, isbn: str, pending: Dict[str, Optional[Book]]) -> bool:
+        return pending[isbn] is not None if isbn in pending else isbn in self._by_isbn
+    
+    def _stage(self, isbn: str, book: Optional[Book], pending: Dict[str, Optional[Book]]) -> None:
+        # Re-inserted so the pending order is the order of last change, as in the books themselves
+        pending.pop(isbn, None)
+        pending[isbn] = book
+    
+    def _insert(self, book: Book, pending: Dict[str, Optional[Book]]) -> Dict[str, str]:
+        if self._has(book.isbn, pending):
+            raise ValueError(f"Book with ISBN {book.isbn} already exists")
+        self._stage(book.isbn, book, pending)
+        return {'op': 'add', **book.to_dict()}
+    
+    def _delete(self, isbn: str, pending: Dict[str, Optional[Book]]) -> Optional[Dict[str, str]]:
+        if not self._has(isbn, pending):
+            return None
+        self._stage(isbn, None, pending)
+        return {'op': 'del', 'isbn': isbn}
+    
+    def _commit(self, pending: Dict[str, Optional[Book]]) -> None:
+        """Apply staged changes that have reached the log"""
+        for isbn, book in pending.items():
+            self._by_isbn.pop(isbn, None)
+            if book is not None:
+                self._by_isbn[isbn] = book
+        self.version += 1
+    
+    def _append_log(self, entries: List[Dict[str, str]]) -> None:
+        data = memoryview(b''.join(orjson.dumps(entry) + b'\n' for entry in entries))
         try:
-            with httpx.Client(timeout=10.0) as client:
-                response = client.get(f"https://openlibrary.org/isbn/{isbn}.json")
-                
-                if response.status_code == 404:
-                    raise ValueError(f"Book with ISBN {isbn} not found")
-                
-                response.raise_for_status()
-                book_data = response.json()
-                
-                # Extract title
-                title = book_data.get('title', 'Unknown Title')
-                
-                # Extract authors - they can be in different formats
-                authors = []
-                if 'authors' in book_data:
-                    for author_ref in book_data['authors']:
-                        if isinstance(author_ref, dict) and 'key' in author_ref:
-                            # Fetch author details
-                            author_response = client.get(f"https://openlibrary.org{author_ref['key']}.json")
-                            if author_response.status_code == 200:
-                                author_data = author_response.json()
-                                authors.append(author_data.get('name', 'Unknown Author'))
-                
-                # If no authors found or extraction failed, use a default
-                if not authors:
-                    authors = ['Unknown Author']
-                
-                # Combine author names
-                author = ', '.join(authors)
+            # Unbuffered, so nothing is left to be flushed after a failed write has been cut off
+            with open(self.log_filename, 'ab', buffering=0) as file:
+                start = file.tell()
+                try:
+                    while data:
+                        data = data[file.write(data):]
+                    os.fsync(file.fileno())
+                except IOError:
+                    # Cut the log back to where it was, so a torn line can't hide later appends on
+                    # replay and whole lines the caller is told failed aren't replayed either
+                    file.truncate(start)
+                    os.fsync(file.fileno())
+                    raise
+        except IOError as e:
+            raise IOError(f"Failed to save books to {self.log_filename}: {e}")
+        
+        self._log_entries += len(entries)
+    
+    def _compact_if_due(self) -> None:
+        if self._log_entries >= self.compact_every:
+            self.compact()
+    
+    async def _run_batches(self) -> None:
+        closing = False
+        while not closing or not self._queue.empty():
+            items = [await self._queue.get()]
+            while not self._queue.empty():
+                items.append(self._queue.get_nowait())
+            # close() queued None; writes queued behind it are still flushed before stopping
+            closing = closing or None in items
+            batch = [item for item in items if item is not None]
+            if not batch:
+                continue
+            
+            # Apply the whole batch in memory, then persist it with one write
+            entries = []
+            outcomes = []
+            error = None
+            snapshot = None
+            async with self.lock.writer:
+                pending: Dict[str, Optional[Book]] = {}
+                for (action, arg), future in batch:
+                    try:
+                        entry = self._insert(arg, pending) if action == 'add' else self._delete(arg, pending)
+                    except ValueError as e:
+                        outcomes.append((future, None, e))
+                        continue
+                    if entry is not None:
+                        entries.append(entry)
+                    outcomes.append((future, entry, arg if action == 'add' else entry is not None))
                 
-                # Create and add book
-                book = Book(title, author, isbn)
-                self.add_book(book)
-                return book
+                if entries:
+                    try:
+                        await asyncio.to_thread(self._append_log, entries)
+                    except IOError as e:
+                        # Readers must never see changes that aren't on disk, so the batch is dropped
+                        error = e
+                    else:
+                        self._commit(pending)
+                        if self._log_entries >= self.compact_every:
+                            # Only the copy is made under the lock; readers aren't blocked by the snapshot write
+                            snapshot = list(self._by_isbn.values())
+            
+            for future, entry, result in outcomes:
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                elif error is not None and entry is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            
+            # This task is the only writer, so no entry can reach the log before the compaction finishes
+            if snapshot is not None:
+                try:
+                    await asyncio.to_thread(self.compact, snapshot)
+                except IOError:
+                    # Every change is still in the log; compaction is retried after the next batch
+                    pass
+    
+    def _replay_log(self) -> None:
+        intact = 0
+        with open(self.log_filename, 'rb') as file:
+            for line in file:
+                # A line without its newline was cut off mid-write, even if what remains parses
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = orjson.loads(line)
+                    if entry['op'] == 'add':
+                        self._by_isbn[entry['isbn']] = Book(entry['title'], entry['author'], entry['isbn'])
+                    elif entry['op'] == 'del':
+                        self._by_isbn.pop(entry['isbn'], None)
+                except (json.JSONDecodeError, KeyError):
+                    # A torn final line from an interrupted write; everything before it is intact
+                    break
+                intact += len(line)
+                self._log_entries += 1
+            else:
+                return
         
+        # Cut the torn tail off, or the next append would be glued onto it and lost on replay
+        with open(self.log_filename, 'r+b') as file:
+            file.truncate(intact)
+            file.flush()
+            os.fsync(file.fileno())
+    
+    async def add_book_by_isbn(self, isbn: str, client: Optional[httpx.AsyncClient] = None) -> Book:
+        """Look up a book on Open Library and add it.
+        
+        Pass a long-lived ``client`` to reuse its connection pool; otherwise a
+        client is created for this call only. Concurrent calls for the same
+        ISBN wait on the first one and get the same book. Malformed ISBNs are
+        rejected without contacting Open Library.
+        """
+        isbn = normalize_isbn(isbn)
+        
+        # Reject known ISBNs before any lookup work
+        if isbn in self:
+            raise ValueError(f"Book with ISBN {isbn} already exists")
+        
+        task = self._inflight.get(isbn)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(self._add_book_by_isbn(isbn, client))
+            self._inflight[isbn] = task
+            
+            def forget(done: asyncio.Task) -> None:
+                if self._inflight.get(isbn) is done:
+                    del self._inflight[isbn]
+            
+            task.add_done_callback(forget)
+        
+        # Shielded so one caller giving up doesn't cancel the lookup for the others
+        return await asyncio.shield(task)
+    
+    async def _add_book_by_isbn(self, isbn: str, client: Optional[httpx.AsyncClient]) -> Book:
+        try:
+            if client is None:
+                async with httpx.AsyncClient(timeout=10.0) as client:
+                    title, author = await self._fetch_book_info(client, isbn)
+            else:
+                title, author = await self._fetch_book_info(client, isbn)
         except httpx.TimeoutException:
             raise ConnectionError("Request timed out while fetching book information")
         except httpx.ConnectError:
@@ -129,4 +447,52 @@ class Library:
             # Re-raise ValueError exceptions (like "Book not found")
             raise
         except Exception as e:
-            raise ConnectionError(f"Unexpected error occurred: {e}")
\ No newline at end of file
+            raise ConnectionError(f"Unexpected error occurred: {e}")
+        
+        # Create and add book
+        return await self.apply(('add', Book(title, author, isbn)))
+    
+    async def _fetch_book_info(self, client: httpx.AsyncClient, isbn: str) -> Tuple[str, str]:
+        book_data = self.lookup_cache.get(f"isbn:{isbn}")
+        if book_data is None:
+            response = await client.get(f"https://openlibrary.org/isbn/{isbn}.json")
+            
+            if response.status_code == 404:
+                raise ValueError(f"Book with ISBN {isbn} not found")
+            
+            response.raise_for_status()
+            book_data = response.json()
+            self.lookup_cache.set(f"isbn:{isbn}", book_data)
+        
+        # Extract title
+        title = book_data.get('title', 'Unknown Title')
+        
+        # Extract authors - they can be in different formats
+        author_keys = [
+            author_ref['key']
+            for author_ref in book_data.get('authors', [])
+            if isinstance(author_ref, dict) and 'key' in author_ref
+        ]
+        author_names = {key: self.lookup_cache.get(f"author:{key}") for key in author_keys}
+        missing_keys = [key for key, name in author_names.items() if name is None]
+        
+        # Fetch uncached author details concurrently; a failed lookup just drops that author
+        author_responses = await asyncio.gather(
+            *(client.get(f"https://openlibrary.org{key}.json") for key in missing_keys),
+            return_exceptions=True
+        )
+        for key, author_response in zip(missing_keys, author_responses):
+            if isinstance(author_response, BaseException) or author_response.status_code != 200:
+                continue
+            author_data = author_response.json()
+            author_names[key] = author_data.get('name', 'Unknown Author')
+            self.lookup_cache.set(f"author:{key}", author_names[key])
+        
+        authors = [author_names[key] for key in author_keys if author_names[key] is not None]
+        
+        # If no authors found or extraction failed, use a default
+        if not authors:
+            authors = ['Unknown Author']
+        
+        # Combine author names
+        return title, ', '.join(authors)
\ No newline at end of file
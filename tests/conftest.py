@@ -0,0 +1,104 @@
+import json
+import httpx
+import pytest
+from pathlib import Path
+from models import Book, Library
+
+
+# Open Library payloads for the happy-path tests, keyed by URL path
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+
+class OpenLibraryTransport(httpx.MockTransport):
+    """Answers Open Library requests with canned responses keyed by URL path.
+    
+    A response may also be an exception, which is raised as if the request failed.
+    Unknown paths get a 404, like Open Library itself.
+    """
+    
+    def __init__(self):
+        super().__init__(self.respond)
+        self.responses = {}
+        # URLs requested so far, in order
+        self.requests = []
+    
+    def __setitem__(self, path, response):
+        self.responses[path] = response
+    
+    def replay(self, fixture: str):
+        """Serve every payload in a fixture file as a 200 response"""
+        with open(FIXTURES_DIR / fixture) as f:
+            for path, body in json.load(f).items():
+                self[path] = httpx.Response(200, json=body)
+    
+    def respond(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(str(request.url))
+        response = self.responses.get(request.url.path)
+        if response is None:
+            return httpx.Response(404)
+        if isinstance(response, BaseException):
+            raise response
+        return response
+
+
+def refuse(request: httpx.Request) -> httpx.Response:
+    # pytest.fail raises a BaseException, so the library's own error handling can't swallow it
+    pytest.fail(f"Unstubbed request to {request.url}")
+
+
+def use_transport(monkeypatch, transport: httpx.AsyncBaseTransport):
+    """Make every AsyncClient created for the rest of the test default to the given transport"""
+    class StubAsyncClient(httpx.AsyncClient):
+        def __init__(self, *args, **kwargs):
+            kwargs.setdefault('transport', transport)
+            super().__init__(*args, **kwargs)
+    
+    monkeypatch.setattr(httpx, "AsyncClient", StubAsyncClient)
+
+
+@pytest.fixture(autouse=True)
+def no_network(monkeypatch):
+    """Fail any test that makes an HTTP request it hasn't stubbed with its own transport"""
+    use_transport(monkeypatch, httpx.MockTransport(refuse))
+
+
+@pytest.fixture
+def http(monkeypatch):
+    """Route every AsyncClient created during the test through a stub Open Library"""
+    transport = OpenLibraryTransport()
+    use_transport(monkeypatch, transport)
+    return transport
+
+
+@pytest.fixture
+def lib_path(tmp_path):
+    """Path to a library file that does not exist yet"""
+    return tmp_path / "library.json"
+
+
+@pytest.fixture
+def library(lib_path):
+    """Library backed by a fresh file in pytest's temporary directory"""
+    return Library(str(lib_path))
+
+
+@pytest.fixture(scope="session")
+def gatsby():
+    """One shared Book for tests that only read it"""
+    return Book("The Great Gatsby", "F. Scott Fitzgerald", "9780743273565")
+
+
+@pytest.fixture(scope="module")
+def corrupted_path(tmp_path_factory):
+    """Library file holding invalid JSON, written once per module"""
+    path = tmp_path_factory.mktemp("corrupted") / "library.json"
+    path.write_text("invalid json content")
+    return path
+
+
+@pytest.fixture(scope="module")
+def missing_fields_path(tmp_path_factory):
+    """Library file whose only book has no ISBN, written once per module"""
+    path = tmp_path_factory.mktemp("missing_fields") / "library.json"
+    path.write_text(json.dumps([{"title": "Test", "author": "Test"}]))
+    return path
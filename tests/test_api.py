@@ -1,36 +1,25 @@
 import pytest
-import tempfile
-import os
+import httpx
 from fastapi.testclient import TestClient
-from unittest.mock import patch, Mock
+from unittest.mock import patch
 from api import app
-from models import Library, Book
+from models import Book
 
 
 @pytest.fixture
-def temp_library_file():
-    """Create a temporary file for testing"""
-    temp_file = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.json')
-    temp_file.close()
-    yield temp_file.name
-    # Cleanup
-    if os.path.exists(temp_file.name):
-        os.unlink(temp_file.name)
+def client(library):
+    """Create a test client with a temporary library file"""
+    # Patch the library instance in the api module
+    with patch('api.library', library):
+        with TestClient(app) as test_client:
+            yield test_client, library
 
 
 @pytest.fixture
-def client(temp_library_file):
-    """Create a test client with a temporary library file"""
-    with patch('api.library') as mock_library:
-        mock_library.return_value = Library(temp_library_file)
-        # Replace the global library instance
-        from api import library
-        test_library = Library(temp_library_file)
-        
-        # Patch the library instance in the api module
-        with patch('api.library', test_library):
-            with TestClient(app) as test_client:
-                yield test_client, test_library
+def open_library(client, http):
+    """Point the app's shared client at the stub Open Library"""
+    with patch.object(app.state, 'http_client', httpx.AsyncClient()):
+        yield http
 
 
 class TestAPI:
@@ -71,6 +60,35 @@ class TestAPI:
         assert data[0]["title"] == "Test Book 1"
         assert data[1]["title"] == "Test Book 2"
     
+    def test_get_all_books_etag(self, client):
+        test_client, library = client
+        library.add_book(Book("Test Book 1", "Test Author 1", "1234567890"))
+        
+        response = test_client.get("/books")
+        etag = response.headers["etag"]
+        
+        # Unchanged library answers conditional requests with 304
+        response = test_client.get("/books", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        
+        # Any change produces a new ETag and a fresh body
+        library.add_book(Book("Test Book 2", "Test Author 2", "0987654321"))
+        response = test_client.get("/books", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+        assert len(response.json()) == 2
+    
+    def test_get_book_by_isbn_etag(self, client):
+        test_client, library = client
+        library.add_book(Book("Found Book", "Found Author", "1111111111"))
+        
+        response = test_client.get("/books/1111111111")
+        etag = response.headers["etag"]
+        
+        response = test_client.get("/books/1111111111", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+    
     def test_get_book_by_isbn_found(self, client):
         test_client, library = client
         # Add a test book
@@ -84,6 +102,18 @@ class TestAPI:
         assert data["author"] == "Found Author"
         assert data["isbn"] == "1111111111"
     
+    def test_hyphenated_isbn_finds_book(self, client, open_library):
+        test_client, library = client
+        open_library.replay("open_library.json")
+        
+        # A book added by its hyphenated ISBN is stored and found under the normalized form
+        response = test_client.post("/books", json={"isbn": "978-0-7432-7356-5"})
+        assert response.json()["isbn"] == "9780743273565"
+        
+        assert test_client.get("/books/978-0-7432-7356-5").json()["title"] == "The Great Gatsby"
+        assert test_client.delete("/books/978-0-7432-7356-5").status_code == 200
+        assert len(library) == 0
+    
     def test_get_book_by_isbn_not_found(self, client):
         test_client, _ = client
         response = test_client.get("/books/9999999999")
@@ -113,38 +143,13 @@ class TestAPI:
         assert response.status_code == 404
         assert "not found" in response.json()["detail"]
     
-    @patch('httpx.Client')
-    def test_add_book_by_isbn_success(self, mock_client_class, client):
+    def test_add_book_by_isbn_success(self, client, open_library):
         test_client, library = client
-        
-        # Mock the HTTP client and responses
-        mock_client = Mock()
-        mock_client_class.return_value.__enter__.return_value = mock_client
-        
-        # Mock book data response
-        mock_book_response = Mock()
-        mock_book_response.status_code = 200
-        mock_book_response.json.return_value = {
+        open_library["/isbn/3333333333.json"] = httpx.Response(200, json={
             'title': 'API Test Book',
             'authors': [{'key': '/authors/OL123A'}]
-        }
-        
-        # Mock author data response
-        mock_author_response = Mock()
-        mock_author_response.status_code = 200
-        mock_author_response.json.return_value = {
-            'name': 'API Test Author'
-        }
-        
-        # Configure mock to return different responses for different URLs
-        def mock_get(url):
-            if 'isbn' in url:
-                return mock_book_response
-            elif 'authors' in url:
-                return mock_author_response
-        
-        mock_client.get.side_effect = mock_get
-        mock_book_response.raise_for_status = Mock()
+        })
+        open_library["/authors/OL123A.json"] = httpx.Response(200, json={'name': 'API Test Author'})
         
         # Test the API endpoint
         response = test_client.post("/books", json={"isbn": "3333333333"})
@@ -159,38 +164,29 @@ class TestAPI:
         assert book is not None
         assert book.title == "API Test Book"
     
-    @patch('httpx.Client')
-    def test_add_book_by_isbn_not_found(self, mock_client_class, client):
+    def test_add_book_by_isbn_not_found(self, client, open_library):
         test_client, _ = client
-        
-        # Mock the HTTP client to return 404
-        mock_client = Mock()
-        mock_client_class.return_value.__enter__.return_value = mock_client
-        
-        mock_response = Mock()
-        mock_response.status_code = 404
-        mock_client.get.return_value = mock_response
+        open_library["/isbn/9999999999.json"] = httpx.Response(404)
         
         response = test_client.post("/books", json={"isbn": "9999999999"})
         assert response.status_code == 400
         assert "not found" in response.json()["detail"]
     
-    @patch('httpx.Client')
-    def test_add_book_by_isbn_connection_error(self, mock_client_class, client):
+    def test_add_book_by_isbn_connection_error(self, client, open_library):
         test_client, _ = client
-        
-        # Mock the HTTP client to raise connection error
-        mock_client = Mock()
-        mock_client_class.return_value.__enter__.return_value = mock_client
-        
-        import httpx
-        mock_client.get.side_effect = httpx.ConnectError("Connection failed")
+        open_library["/isbn/4444444444.json"] = httpx.ConnectError("Connection failed")
         
         response = test_client.post("/books", json={"isbn": "4444444444"})
         assert response.status_code == 503
         assert "Service unavailable" in response.json()["detail"]
     
-    def test_add_book_duplicate_isbn(self, client):
+    def test_shared_http_client(self, client):
+        # The lifespan opens one pooled client that every lookup reuses
+        http_client = app.state.http_client
+        assert isinstance(http_client, httpx.AsyncClient)
+        assert not http_client.is_closed
+    
+    def test_add_book_duplicate_isbn(self, client, open_library):
         test_client, library = client
         
         # Add a book first
@@ -198,13 +194,47 @@ class TestAPI:
         library.add_book(book)
         
         # Try to add the same ISBN via API (this should fail without calling external API)
-        with patch('httpx.Client') as mock_client_class:
-            mock_client = Mock()
-            mock_client_class.return_value.__enter__.return_value = mock_client
-            
-            response = test_client.post("/books", json={"isbn": "5555555555"})
-            assert response.status_code == 400
-            assert "already exists" in response.json()["detail"]
+        response = test_client.post("/books", json={"isbn": "5555555555"})
+        assert response.status_code == 400
+        assert "already exists" in response.json()["detail"]
+    
+    def test_add_books_batch(self, client, open_library):
+        test_client, library = client
+        library.add_book(Book("Existing Book", "Existing Author", "5555555555"))
+        
+        # One found book (without authors); any other ISBN is unknown to Open Library
+        open_library["/isbn/3333333333.json"] = httpx.Response(200, json={'title': 'Batch Book'})
+        
+        response = test_client.post("/books/batch", json={"isbns": ["3333333333", "9999999999", "5555555555"]})
+        assert response.status_code == 200
+        data = response.json()
+        assert [item["status_code"] for item in data] == [200, 400, 400]
+        assert data[0]["book"]["title"] == "Batch Book"
+        assert "not found" in data[1]["detail"]
+        assert "already exists" in data[2]["detail"]
+        
+        # Only the found book was added
+        assert library.find_book("3333333333") is not None
+        assert len(library.books) == 2
+    
+    def test_add_books_batch_invalid_request(self, client):
+        test_client, _ = client
+        
+        response = test_client.post("/books/batch", json={"isbns": []})
+        assert response.status_code == 422
+        
+        response = test_client.post("/books/batch", json={"isbns": [str(i) for i in range(101)]})
+        assert response.status_code == 422
+    
+    def test_unexpected_error_returns_json(self, client):
+        _, library = client
+        
+        with patch.object(library, 'find_book', side_effect=RuntimeError("boom")):
+            with TestClient(app, raise_server_exceptions=False) as test_client:
+                response = test_client.get("/books/1111111111")
+        
+        assert response.status_code == 500
+        assert response.json() == {"detail": "Internal server error: boom"}
     
     def test_add_book_invalid_request(self, client):
         test_client, _ = client
@@ -216,6 +246,19 @@ class TestAPI:
         # Test with invalid JSON structure
         response = test_client.post("/books", json={"invalid_field": "value"})
         assert response.status_code == 422  # Validation error
+        
+        # Test with a malformed ISBN
+        response = test_client.post("/books", json={"isbn": "1234567891"})
+        assert response.status_code == 422  # Validation error
+    
+    def test_openapi_documents_book_responses(self, client):
+        test_client, _ = client
+        paths = test_client.get("/openapi.json").json()["paths"]
+        
+        list_schema = paths["/books"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+        assert list_schema["items"]["$ref"] == "#/components/schemas/BookResponse"
+        book_schema = paths["/books/{isbn}"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+        assert book_schema["$ref"] == "#/components/schemas/BookResponse"
     
     def test_api_cors_headers(self, client):
         test_client, _ = client